@@ -1,15 +1,28 @@
 import azure.functions as func
+import asyncio
 import logging
 import json
+from typing import Optional
 from parse_reports import process_sharepoint_files
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
+# Run currently processing the SharePoint list; overlapping requests share it
+_inflight: Optional[asyncio.Future] = None
+
 @app.route(route="http_trigger")
-def http_trigger(req: func.HttpRequest) -> func.HttpResponse:
+async def http_trigger(req: func.HttpRequest) -> func.HttpResponse:
+    global _inflight
     logging.info('Monthly Reports processed a request.')
 
-    filecount = process_sharepoint_files()   
+    # Blocking Graph/openpyxl work runs on a worker thread so the host's event loop stays free
+    if _inflight is None or _inflight.done():
+        _inflight = asyncio.ensure_future(asyncio.to_thread(process_sharepoint_files))
+    else:
+        logging.info('Processing already in progress, waiting for the running batch.')
+
+    # Shield so a cancelled request doesn't cancel the run other callers are waiting on
+    filecount = await asyncio.shield(_inflight)
     logging.info(f'Processed {filecount} files.')
 
     return func.HttpResponse(
@@ -0,0 +1,223 @@
+"""
+Shared Microsoft Graph helpers (MSAL token, pooled session, $batch, site lookup) used by parse_reports.py and search_sharepoint.py
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+import msal
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from sharepoint_config import CLIENT_SECRET, CLIENT_CERT_THUMBPRINT, CLIENT_CERT_PRIVATE_KEY
+
+GRAPH_URL = "https://graph.microsoft.com/v1.0"
+
+# Optional file the MSAL token cache is persisted to, so a restarted process can reuse its token
+MSAL_CACHE_PATH = os.environ.get("MSAL_TOKEN_CACHE_PATH")
+
+# Longest server-requested Retry-After honoured, in seconds, by both the session and graph_batch
+MAX_RETRY_AFTER = 60
+
+
+class _CappedRetry(Retry):
+    """Retry that waits for Retry-After, but never longer than MAX_RETRY_AFTER"""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, MAX_RETRY_AFTER)
+
+
+# One pooled session for all Graph/SharePoint traffic so TCP+TLS connections are reused
+# across calls and worker threads; transient throttling/server errors are retried with backoff,
+# sleeping for the server's Retry-After when it sends one
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=20,
+    max_retries=_CappedRetry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+        # POST is used for $batch of GETs/flag PATCHes and for the read-only /search/query; PATCH only sets
+        # a flag, so all are safe to repeat. For $batch this covers the outer POST only; throttled
+        # sub-responses are resent by graph_batch.
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"POST", "PATCH"},
+        # raise_on_status=False hands the final response back so callers' status checks still apply
+        raise_on_status=False,
+    )
+))
+
+# Site IDs are stable for the process lifetime, so each (host, site) is resolved once
+_SITE_ID_CACHE = {}
+_SITE_ID_LOCK = threading.Lock()
+
+# Graph JSON batching accepts at most 20 sub-requests per $batch call
+BATCH_LIMIT = 20
+
+# Throttled sub-responses come back inside a 200 batch, so the session's Retry never sees them;
+# graph_batch resends them itself, waiting for the largest Retry-After (capped at MAX_RETRY_AFTER) between attempts
+BATCH_RETRY_STATUSES = {429, 503, 504}
+BATCH_MAX_RETRIES = 3
+BATCH_BACKOFF = 0.5  # seconds, doubled per attempt when no Retry-After is given
+
+
+def _post_batch(headers, chunk):
+    """POST one $batch call; returns its sub-responses by id (empty if the call itself failed)"""
+    try:
+        response = SESSION.post(f"{GRAPH_URL}/$batch", headers=headers, json={"requests": chunk})
+        if response.status_code != 200:
+            logging.error(f'Graph batch error: {response.status_code} - {response.text}')
+            return {}
+
+        return {sub_response.get('id'): sub_response for sub_response in response.json().get('responses', [])}
+    except Exception as e:
+        logging.error(f'Error sending Graph batch: {str(e)}')
+        return {}
+
+
+def _retry_after(sub_response, default):
+    """Seconds to wait before resending a throttled sub-request, from its Retry-After header"""
+    headers = {name.lower(): value for name, value in (sub_response.get('headers') or {}).items()}
+    try:
+        return float(headers.get('retry-after', default))
+    except (TypeError, ValueError):
+        return default
+
+
+def graph_batch(access_token, requests_list):
+    """
+    Send Graph sub-requests through JSON batching, BATCH_LIMIT per call.
+    Each entry is a dict with "id", "method" and a relative "url" (plus optional "headers"/"body").
+    Sub-requests throttled with 429/503/504 are resent up to BATCH_MAX_RETRIES times.
+    Returns a dict of sub-response by id; sub-requests whose batch call failed are missing.
+    """
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type': 'application/json'
+    }
+
+    responses = {}
+    pending = requests_list
+    attempt = 0
+    while True:
+        for start in range(0, len(pending), BATCH_LIMIT):
+            responses.update(_post_batch(headers, pending[start:start + BATCH_LIMIT]))
+
+        throttled = [request for request in pending
+                     if responses.get(request['id'], {}).get('status') in BATCH_RETRY_STATUSES]
+        if not throttled or attempt == BATCH_MAX_RETRIES:
+            break
+
+        default_delay = BATCH_BACKOFF * 2 ** attempt
+        delay = min(max(_retry_after(responses[request['id']], default_delay) for request in throttled),
+                    MAX_RETRY_AFTER)
+        logging.warning(f'{len(throttled)} Graph batch sub-requests throttled, retrying in {delay}s')
+        time.sleep(delay)
+        pending = throttled
+        attempt += 1
+
+    return responses
+
+
+def get_site_id(access_token, host="jjag.sharepoint.com", site_path="InternalTeam"):
+    """Return the Graph site ID for host:/sites/site_path, resolving it once per process. None on failure."""
+    key = (host, site_path)
+    site_id = _SITE_ID_CACHE.get(key)
+    if site_id:
+        return site_id
+
+    with _SITE_ID_LOCK:
+        # Another worker may have resolved it while we waited for the lock
+        site_id = _SITE_ID_CACHE.get(key)
+        if site_id:
+            return site_id
+
+        site_info_url = f"{GRAPH_URL}/sites/{host}:/sites/{site_path}:"
+        site_response = SESSION.get(site_info_url, headers={'Authorization': f'Bearer {access_token}'})
+
+        if site_response.status_code != 200:
+            logging.error(f'Failed to get site info: {site_response.status_code} - {site_response.text}')
+            return None
+
+        site_id = _SITE_ID_CACHE[key] = site_response.json()['id']
+        return site_id
+
+
+@functools.lru_cache(maxsize=8)
+def _get_msal_app(client_id, tenant_id):
+    """Build the MSAL confidential client once per client/tenant; its in-memory token cache lives on the instance"""
+    # Prefer the app certificate when configured; fall back to the client secret
+    if CLIENT_CERT_THUMBPRINT and CLIENT_CERT_PRIVATE_KEY:
+        client_credential = {"thumbprint": CLIENT_CERT_THUMBPRINT, "private_key": CLIENT_CERT_PRIVATE_KEY}
+    else:
+        client_credential = CLIENT_SECRET
+
+    return msal.ConfidentialClientApplication(
+        client_id=client_id,
+        client_credential=client_credential,
+        authority=f"https://login.microsoftonline.com/{tenant_id}",
+        token_cache=_load_token_cache()
+    )
+
+
+def _load_token_cache():
+    """Return a token cache, pre-filled from MSAL_CACHE_PATH when that file exists"""
+    cache = msal.SerializableTokenCache()
+    if MSAL_CACHE_PATH and os.path.exists(MSAL_CACHE_PATH):
+        try:
+            with open(MSAL_CACHE_PATH, 'r') as cache_file:
+                cache.deserialize(cache_file.read())
+        except Exception as e:
+            logging.warning(f'Ignoring unreadable token cache {MSAL_CACHE_PATH}: {str(e)}')
+    return cache
+
+
+def _save_token_cache(cache):
+    """Write the token cache back to MSAL_CACHE_PATH if a new token was added"""
+    if not MSAL_CACHE_PATH or not cache.has_state_changed:
+        return
+    try:
+        # The cache holds a bearer token, so keep the file private to this user
+        fd = os.open(MSAL_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as cache_file:
+            cache_file.write(cache.serialize())
+        cache.has_state_changed = False
+    except Exception as e:
+        logging.warning(f'Could not save token cache {MSAL_CACHE_PATH}: {str(e)}')
+
+
+def get_sharepoint_token(client_id=None, tenant_id=None): 
+    """Get SharePoint access token using MSAL (served from the token cache until it nears expiry)"""
+    try:
+        if not client_id:
+            logging.error('No client ID provided')
+            return None
+            
+        if not tenant_id:
+            logging.error('No tenant ID provided')
+            return None
+
+        scopes = ["https://graph.microsoft.com/.default"]
+
+        # MSAL >= 1.23 checks its cache first and only calls the token endpoint when needed
+        app = _get_msal_app(client_id, tenant_id)
+        result = app.acquire_token_for_client(scopes=scopes)
+        _save_token_cache(app.token_cache)
+        
+        if "access_token" in result:
+            if result.get("token_source") == "cache":
+                logging.info('Using cached token')
+            else:
+                logging.info("Authentication successful!")
+            return result["access_token"]
+
+        logging.error(f"Error getting token: {result.get('error_description', 'Unknown error')}")
+        return None
+        
+    except Exception as e:
+        logging.error(f'Error in SharePoint authentication: {str(e)}')
+        return None
@@ -1,40 +1,122 @@
 # Azure Key Vault access
 
+import functools
+import logging
 import os
-from typing import Optional
-from azure.identity import AzureCliCredential
-from azure.keyvault.secrets import SecretClient
-import dotenv
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
 
-dotenv.load_dotenv()  # Load environment variables from .env file if present
+# The Azure SDK (and msal/cryptography beneath it) is imported on first Key Vault use,
+# so cold starts where every secret comes from the environment skip that import cost
+if TYPE_CHECKING:
+    from azure.keyvault.secrets import SecretClient
+
+# Shared across all secret lookups so the credential probe and client pipeline are built once
+_CREDENTIAL = None
+_CREDENTIAL_FAILED = False  # set once a real Key Vault call fails to authenticate
+_KV_CLIENTS: dict[str, "SecretClient"] = {}
+_LOCK = threading.Lock()
+_dotenv_loaded = False
+
+
+def _load_dotenv():
+    """Load environment variables from .env file if present (once, on first secret lookup)"""
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        import dotenv
+        dotenv.load_dotenv()
+        _dotenv_loaded = True
+
+
+def _token_cache_options() -> dict:
+    """Persist MSAL tokens to disk when KEY_VAULT_PERSIST_TOKEN_CACHE is set (skip where disk isn't durable)"""
+    if os.environ.get("KEY_VAULT_PERSIST_TOKEN_CACHE", "").lower() not in ("1", "true", "yes"):
+        return {}
+    from azure.identity import TokenCachePersistenceOptions
+    return {
+        "cache_persistence_options": TokenCachePersistenceOptions(
+            name="monthly_report_cache", allow_unencrypted_storage=True
+        )
+    }
 
 
 def get_azure_credential():
-    """Get Azure credential using Azure CLI"""    
-    try:
-        credential = AzureCliCredential()
-        # Test the credential
-        credential.get_token("https://vault.azure.net/.default")
-        print("Using Azure CLI authentication")
-        return credential
-    except Exception:
-        pass
+    """
+    Get an Azure credential chaining service principal env vars, Azure CLI and managed identity (cached).
+    The credential is not probed here - the first real Key Vault call authenticates, and a
+    failure there is remembered so later lookups skip Key Vault instead of re-running auth.
+    """
+    global _CREDENTIAL
+    with _LOCK:
+        if _CREDENTIAL_FAILED:
+            return None
+        if _CREDENTIAL is not None:
+            return _CREDENTIAL
+        try:
+            from azure.identity import (
+                AzureCliCredential,
+                ChainedTokenCredential,
+                EnvironmentCredential,
+                ManagedIdentityCredential,
+            )
+            # Only the credentials that apply here, rather than DefaultAzureCredential's full probe list:
+            # environment and CLI fail fast when unavailable, managed identity covers the Function App
+            credential = ChainedTokenCredential(
+                EnvironmentCredential(**_token_cache_options()),
+                AzureCliCredential(),
+                ManagedIdentityCredential(),
+            )
+            logging.info("Using Azure credential chain (environment, Azure CLI, managed identity)")
+            _CREDENTIAL = credential
+            return credential
+        except Exception:
+            pass
+
+
+def _mark_credential_failed():
+    """Drop the cached credential and clients after an authentication failure"""
+    global _CREDENTIAL, _CREDENTIAL_FAILED
+    with _LOCK:
+        _CREDENTIAL_FAILED = True
+        _CREDENTIAL = None
+        _KV_CLIENTS.clear()
     
 
-def get_kv_client() -> Optional[SecretClient]:
+def get_kv_client() -> Optional["SecretClient"]:
     """Return a SecretClient if KEY_VAULT_NAME is configured, else None."""
+    _load_dotenv()
     kv_name = os.environ.get("KEY_VAULT_NAME")
     if not kv_name:
-        print("KEY_VAULT_NAME not configured, skipping Key Vault access")
+        logging.info("KEY_VAULT_NAME not configured, skipping Key Vault access")
         return None
+
+    vault_uri = f"https://{kv_name}.vault.azure.net"
+    client = _KV_CLIENTS.get(vault_uri)
+    if client is not None:
+        return client
     
     credential = get_azure_credential()
     if not credential:
-        print("No valid Azure authentication found, skipping Key Vault access")
+        logging.warning("No valid Azure authentication found, skipping Key Vault access")
         return None
         
-    vault_uri = f"https://{kv_name}.vault.azure.net"
-    return SecretClient(vault_url=vault_uri, credential=credential)
+    from azure.keyvault.secrets import SecretClient
+
+    with _LOCK:
+        client = _KV_CLIENTS.get(vault_uri)
+        if client is None:
+            client = _KV_CLIENTS[vault_uri] = SecretClient(vault_url=vault_uri, credential=credential)
+        return client
+
+
+class _SecretUnavailable(Exception):
+    """Raised by _get_found_secret when a secret could not be found; carries the Key Vault error, if any."""
+
+    def __init__(self, secret_name: str, error: Optional[Exception] = None):
+        super().__init__(secret_name)
+        self.secret_name = secret_name
+        self.error = error
 
 
 def get_secret(env_name: str, kv_secret_name: Optional[str] = None, default_value: Optional[str] = None) -> str:
@@ -42,7 +124,43 @@ def get_secret(env_name: str, kv_secret_name: Optional[str] = None, default_valu
     Fetch a secret from environment, or (if not set) from Azure Key Vault.
     kv_secret_name defaults to env_name if not supplied.
     default_value is returned if secret is not found anywhere.
+    Found values are cached for the lifetime of the process (call clear_secret_cache() to refetch);
+    a default is never cached, so a secret missed through a transient Key Vault error is retried next call.
     """
+    try:
+        return _get_found_secret(env_name, kv_secret_name or env_name)
+    except _SecretUnavailable as exc:
+        if exc.error is not None:
+            from azure.core.exceptions import ResourceNotFoundError
+            if isinstance(exc.error, ResourceNotFoundError) and default_value is not None:
+                # Optional secret that simply isn't configured - expected, not a failure
+                logging.info(f"'{exc.secret_name}' not found in Azure Key Vault")
+            else:
+                logging.warning(f"Failed to retrieve '{exc.secret_name}' from Azure Key Vault: {exc.error}")
+
+    # Return default value or raise error
+    if default_value is not None:
+        logging.info(f"Using default value for '{env_name}'")
+        return default_value
+        
+    raise KeyError(
+        f"Required secret '{env_name}' not found in environment variables, "
+        f"Key Vault not configured/accessible, and no default value provided. "
+        f"Please set the '{env_name}' environment variable or configure Azure authentication."
+    )
+
+
+def clear_secret_cache():
+    """Forget every cached secret so the next get_secret call looks it up again"""
+    _get_found_secret.cache_clear()
+
+
+# lru_cache doesn't cache exceptions, so only secrets that were actually found are kept
+@functools.lru_cache(maxsize=256)
+def _get_found_secret(env_name: str, secret_name: str) -> str:
+    """Look up a secret in the environment, then Key Vault; raises _SecretUnavailable if neither has it."""
+    _load_dotenv()
+
     # First try environment variable
     val = os.environ.get(env_name)
     if val:
@@ -51,21 +169,40 @@ def get_secret(env_name: str, kv_secret_name: Optional[str] = None, default_valu
     # Try Key Vault if configured and authenticated
     client = get_kv_client()
     if client:
-        secret_name = kv_secret_name or env_name
         try:
             result = client.get_secret(secret_name).value 
             return result if result is not None else ""
         except Exception as exc:
-            print(f"Failed to retrieve '{secret_name}' from Azure Key Vault: {exc}")
+            from azure.core.exceptions import ClientAuthenticationError
+            if isinstance(exc, ClientAuthenticationError):
+                _mark_credential_failed()
+            raise _SecretUnavailable(secret_name, exc) from exc
 
-    # Return default value or raise error
-    if default_value is not None:
-        print(f"Using default value for '{env_name}'")
-        return default_value
-        
-    raise KeyError(
-        f"Required secret '{env_name}' not found in environment variables, "
-        f"Key Vault not configured/accessible, and no default value provided. "
-        f"Please set the '{env_name}' environment variable or configure Azure authentication."
-    )
+    raise _SecretUnavailable(secret_name)
+
+
+def get_secrets(names: list[str], defaults: Optional[dict[str, str]] = None) -> dict[str, str]:
+    """
+    Fetch several secrets at once, returning a dict keyed by env name.
+    defaults maps optional names to the value used when they are not found (see get_secret).
+    Names satisfied by the environment resolve immediately; the remaining Key Vault
+    lookups run concurrently so startup pays roughly one round trip instead of one per secret.
+    """
+    _load_dotenv()
+    defaults = defaults or {}
+
+    def lookup(name):
+        return get_secret(name, default_value=defaults.get(name))
+
+    kv_names = [name for name in names if not os.environ.get(name)]
+    secrets = {name: lookup(name) for name in names if name not in kv_names}
+
+    if len(kv_names) > 1:
+        # Build the shared client once up front rather than racing to create it in each worker
+        get_kv_client()
+        with ThreadPoolExecutor(max_workers=min(8, len(kv_names))) as executor:
+            secrets.update(zip(kv_names, executor.map(lookup, kv_names)))
+    else:
+        secrets.update((name, lookup(name)) for name in kv_names)
 
+    return {name: secrets[name] for name in names}
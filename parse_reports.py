@@ -4,76 +4,49 @@ This script parses Excel weekly reports and extracts information into text files
 """
 
 import os
+import posixpath
+from pathlib import Path
 from openpyxl import load_workbook
-import requests
-import msal
 import io
 from urllib.parse import urlparse, quote
-import tempfile
-from search_sharepoint import get_sharepoint_list_items, mark_file_as_processed
+from concurrent.futures import ThreadPoolExecutor
+from search_sharepoint import get_list_column, get_sharepoint_list_items, mark_files_as_processed
+from graph_client import SESSION, get_site_id, get_sharepoint_token, graph_batch
 from sharepoint_config import get_current_month_path
 import logging
 
 # SharePoint configuration
 try:
-    from sharepoint_config import CLIENT_ID, TENANT_ID, CLIENT_SECRET    
+    from sharepoint_config import CLIENT_ID, TENANT_ID
 except ImportError:
     logging.error('sharepoint_config.py not found or has errors.')
     raise
 
-
-def get_sharepoint_token(client_id=None, tenant_id=None, redirect_url=None): 
-    """Get SharePoint access token using MSAL"""
-    try:
-        if not client_id:
-            logging.error('No client ID provided')
-            return None
-            
-        if not tenant_id:
-            logging.error('No tenant ID provided')
-            return None
-
-        # Default redirect URI for public client apps
-        if not redirect_url:
-            logging.error('No redirect URI provided')
-            return None
-        
-        # Initialize MSAL app with fixed redirect URI
-        app = msal.PublicClientApplication(
-            client_id,
-            authority=f"https://login.microsoftonline.com/{tenant_id}"
-        )
-                
-        scopes = ["https://graph.microsoft.com/.default"]
-
-        # Try to get token silently first (from cache)
-        accounts = app.get_accounts()
-        if accounts:
-            result = app.acquire_token_silent(scopes, account=accounts[0])
-            if result and "access_token" in result:
-                logging.info('Using cached token')
-                return result["access_token"]
-        
-        # Tech debt: Temporary workaround should be stored in Key Vault
-        client_secret = CLIENT_SECRET
-        
-        app = msal.ConfidentialClientApplication(
-            client_id=client_id,
-            client_credential=client_secret,
-            authority=f"https://login.microsoftonline.com/{tenant_id}"
-        )
-       
-        result = app.acquire_token_for_client(scopes=scopes)
-        
-        if "access_token" in result:
-
-            logging.info("Authentication successful!")
-            return result["access_token"]
-        return None
-        
-    except Exception as e:
-        logging.error(f'Error in SharePoint authentication: {str(e)}')
-        return None
+# Files processed concurrently by process_sharepoint_files (kept low for SharePoint throttling)
+MAX_WORKERS = 8
+
+# Fixed layout of the weekly report sheet, as 1-based (row, column) numbers
+REPORT_MIN_ROW, REPORT_MAX_ROW = 7, 67  # Area read in one pass: D7:K67
+REPORT_MIN_COL, REPORT_MAX_COL = 4, 11
+HEADER_CELLS = (("Week Ending", 7, 7), ("Service Provider", 11, 7), ("Client", 13, 7))  # G7, G11, G13
+# Monthlyreportprocessed values that mean "already processed" (Yes/No column, or text/number in older lists)
+PROCESSED_VALUES = frozenset({True, 1, "1", "true", "True", "Yes", "yes"})
+
+# Server-side filters for the SharePoint list. SharePoint evaluates both "ne true" and "eq false" as CAML
+# comparisons that never match an empty value, so the processed predicate is only added once no item of
+# this manager is left with an unset flag (see _clear_unset_flags) and the column defaults new items to No.
+MANAGER_FILTER = "fields/manager eq 'Julian Brown'"
+UNPROCESSED_FILTER = f"{MANAGER_FILTER} and fields/Monthlyreportprocessed eq false"
+_UNSET_FLAGS_CLEARED = False
+
+# Table sections: (title, header line, rows, columns); written only when a row has its first column filled
+SECTIONS = (
+    ("Service Standard updates:", "SSN|Status|Comments", range(34, 43), (4, 10, 11)),  # D, J, K
+    ("Service Risks:", "Risk No|Description|Likelihood|Impact|Mitigation", range(45, 48), (4, 5, 8, 10, 11)),  # D, E, H, J, K
+    ("Service Issues:", "Issue No|Description|Impact|Mitigation", range(50, 53), (4, 5, 10, 11)),  # D, E, J, K
+)
+# Free-text sections: (title, row, column); always written, blank when the cell is empty
+TEXT_SECTIONS = (("Planned Activities:", 57, 4), ("Client Updates:", 67, 4))  # D57, D67
 
 
 def search_sharepoint_files(access_token, config=None):
@@ -97,7 +70,7 @@ def search_sharepoint_files(access_token, config=None):
             }]
         }
         
-        response = requests.post(
+        response = SESSION.post(
             'https://graph.microsoft.com/v1.0/search/query',
             headers=headers,
             json=search_query
@@ -130,28 +103,25 @@ def download_sharepoint_file(access_token, file_url):
             site_path = parsed_url.path.split('/sites/')[1].split('/')[0]
             
             # Get file info using Graph API
-            site_id_url = f"https://graph.microsoft.com/v1.0/sites/jjag.sharepoint.com:/sites/{site_path}"
-            site_response = requests.get(site_id_url, headers=headers)
+            site_id = get_site_id(access_token, site_path=site_path)
             
-            if site_response.status_code == 200:
-                site_id = site_response.json()['id']
-                
+            if site_id:
                 # Search for the file using Graph API
                 file_name = file_url.split('/')[-1]
                 search_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root/search(q='{file_name}')"
-                search_response = requests.get(search_url, headers=headers)
+                search_response = SESSION.get(search_url, headers=headers)
                 
                 if search_response.status_code == 200:
                     files = search_response.json().get('value', [])
                     if files:
                         download_url = files[0]['@microsoft.graph.downloadUrl']
-                        file_response = requests.get(download_url)
+                        file_response = SESSION.get(download_url)
                         
                         if file_response.status_code == 200:
                             return file_response.content
         
         # Fallback: try direct download
-        response = requests.get(file_url, headers=headers)
+        response = SESSION.get(file_url, headers=headers)
         if response.status_code == 200:
             return response.content
         else:
@@ -178,21 +148,8 @@ def process_sharepoint_workbook(access_token, file_info):
         if not file_content:
             return False
         
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as temp_file:
-            temp_file.write(file_content)
-            temp_filename = temp_file.name
-        
-        try:
-            # Process the temporary file
-            success = process_workbook_content(temp_filename, file_name, access_token)
-            return success
-        finally:
-            # Clean up temporary file
-            try:
-                os.unlink(temp_filename)
-            except:
-                pass
+        # Parse straight from the downloaded bytes - no temporary file round trip
+        return process_workbook_content_from_memory(file_content, file_name, access_token)
                 
     except Exception as e:
         logging.error(f'Error processing SharePoint workbook: {str(e)}')
@@ -207,7 +164,7 @@ def process_workbook_content_from_memory(file_content, original_name, access_tok
         
         # Load the workbook from memory using BytesIO
         file_like = io.BytesIO(file_content)
-        wb = load_workbook(file_like, data_only=True)
+        wb = load_workbook(file_like, data_only=True, read_only=True, keep_links=False)
         
         return _process_workbook_data(wb, output_name, access_token)
         
@@ -223,7 +180,7 @@ def process_workbook_content(filename, original_name=None, access_token=None):
         output_name = original_name if original_name else os.path.basename(filename)
         
         # Load the workbook
-        wb = load_workbook(filename, data_only=True)
+        wb = load_workbook(filename, data_only=True, read_only=True, keep_links=False)
         
         return _process_workbook_data(wb, output_name, access_token)
         
@@ -235,80 +192,55 @@ def process_workbook_content(filename, original_name=None, access_token=None):
 def _process_workbook_data(wb, output_name, access_token=None):
     """Common workbook processing logic """
     try:
-        # Get the active sheet
-        sheet = wb.active
-        
-        # Validate that we have a sheet
-        if sheet is None:
-            logging.error(f'Error: Could not access active sheet in {output_name}')
+        try:
+            # Get the active sheet
+            sheet = wb.active
+            
+            # Validate that we have a sheet
+            if sheet is None:
+                logging.error(f'Error: Could not access active sheet in {output_name}')
+                return False
+            
+            # Read the report area in a single streaming pass - random cell access
+            # on a read-only sheet re-parses the sheet XML for every lookup.
+            # Merged cells need no special handling: only their top-left cell holds a value.
+            rows = list(sheet.iter_rows(min_row=REPORT_MIN_ROW, max_row=REPORT_MAX_ROW,
+                                        min_col=REPORT_MIN_COL, max_col=REPORT_MAX_COL, values_only=True))
+        finally:
+            # Release the workbook's zip archive as soon as the cells are read, even on error
             wb.close()
-            return False
-        
-        # First check if E33 is merged
-        is_merged, target_range = is_cell_merged(sheet, "E33")
-        
-        if is_merged:
-            logging.info(f'Cell E33 is merged. Unmerging cells in range {target_range}')
-            # Unmerge SSN range
-            for merged_cell_range in list(sheet.merged_cells.ranges):
-                min_col, min_row, max_col, max_row = merged_cell_range.bounds
-                # Check if the merged cell range overlaps with our target range (D31:R42)
-                if not (max_col < 4 or min_col > 19 or max_row < 31 or min_row > 72):
-                    sheet.unmerge_cells(str(merged_cell_range))
-        else:
-            logging.info('Cell E33 is not merged. No action taken.')
 
-        # Create output filename
-        name, ext = output_name.rsplit('.', 1) if '.' in output_name else (output_name, 'xlsx')
-        fname = f"{name}.txt"
+        # Trailing rows missing from the file are not padded by openpyxl
+        empty_row = (None,) * (REPORT_MAX_COL - REPORT_MIN_COL + 1)
+        rows.extend([empty_row] * (REPORT_MAX_ROW - REPORT_MIN_ROW + 1 - len(rows)))
+
+        def cell(row, col):
+            return rows[row - REPORT_MIN_ROW][col - REPORT_MIN_COL]
+
+        # Create output filename. A bare extension (".xlsx", from an empty Reportfilename) parses as a
+        # suffix-less dotfile name, so replace the whole name rather than append to it.
+        output_path = Path(output_name)
+        if output_path.name.startswith('.') and not output_path.suffix:
+            fname = str(output_path.with_name('.txt'))
+        else:
+            fname = str(output_path.with_suffix('.txt'))
 
         # Build content in memory
-        content_lines = []
-        content_lines.append(f"Week Ending: {sheet['G7'].value}")
-        content_lines.append(f"Service Provider: {sheet['G11'].value}")
-        content_lines.append(f"Client: {sheet['G13'].value}")
-        content_lines.append("")
-        content_lines.append("Service Standard updates:")
-        content_lines.append("SSN|Status|Comments")
-        
-        # Service standards
-        for row in range(34, 43):
-            if sheet[f'D{row}'].value:
-                content_lines.append(f"{sheet[f'D{row}'].value}|{sheet[f'J{row}'].value}|{sheet[f'K{row}'].value}")
-
-        # Service Risks
-        content_lines.append("")
-        content_lines.append("Service Risks:")
-        content_lines.append("Risk No|Description|Likelihood|Impact|Mitigation")
-
-        for row in range(45, 48):
-            if sheet[f'D{row}'].value:
-                content_lines.append(f"{sheet[f'D{row}'].value}|{sheet[f'E{row}'].value}|{sheet[f'H{row}'].value}|{sheet[f'J{row}'].value}|{sheet[f'K{row}'].value}")
-
-        # Service Issues
-        content_lines.append("")
-        content_lines.append("Service Issues:")
-        content_lines.append("Issue No|Description|Impact|Mitigation")
-
-        for row in range(50, 53):
-            if sheet[f'D{row}'].value:
-                content_lines.append(f"{sheet[f'D{row}'].value}|{sheet[f'E{row}'].value}|{sheet[f'J{row}'].value}|{sheet[f'K{row}'].value}")
-
-        # Planned Activities
-        content_lines.append("")
-        content_lines.append("Planned Activities:")
-        content_lines.append(str(sheet['D57'].value) if sheet['D57'].value else "")
-
-        # Client Updates
-        content_lines.append("")
-        content_lines.append("Client Updates:")
-        content_lines.append(str(sheet['D67'].value) if sheet['D67'].value else "")
-
-        # Join all content
-        file_content = "\n".join(content_lines)
-        
-        # Close workbook without saving changes
-        wb.close()
+        content_lines = [f"{label}: {cell(row, col)}" for label, row, col in HEADER_CELLS]
+
+        # Sections with no rows are left out entirely, header included
+        for title, header, row_range, cols in SECTIONS:
+            section_rows = ["|".join(str(cell(row, col)) for col in cols) for row in row_range if cell(row, cols[0])]
+            if section_rows:
+                content_lines.extend(("", title, header))
+                content_lines.extend(section_rows)
+
+        for title, row, col in TEXT_SECTIONS:
+            value = cell(row, col)
+            content_lines.extend(("", title, str(value) if value else ""))
+
+        # Join and encode once; the same bytes are uploaded or saved locally
+        file_content = "\n".join(content_lines).encode('utf-8')
         
         # Upload to SharePoint if access token is provided, otherwise save locally
         if access_token:
@@ -320,7 +252,7 @@ def _process_workbook_data(wb, output_name, access_token=None):
                 # Fall back to local save
         
         # Save locally as fallback or when no access token provided
-        with open(fname, 'w', encoding='utf-8') as file:
+        with open(fname, 'wb') as file:
             file.write(file_content)
         logging.info(f'Successfully processed Excel data and saved locally as: {fname}')
         return True
@@ -330,16 +262,8 @@ def _process_workbook_data(wb, output_name, access_token=None):
         return False
 
 
-def is_cell_merged(sheet, cell_coord):
-    """Check if a specific cell is part of a merged range"""
-    for merged_range in sheet.merged_cells.ranges:
-        if cell_coord in merged_range:
-            return True, merged_range
-    return False, None
-
-
-def process_sharepoint_files(client_id=None, tenant_id=None, config=None, redirect_url=None):
-    """Process Excel files from SharePoint using list items"""
+def process_sharepoint_files(client_id=None, tenant_id=None, config=None):
+    """Process Excel files from SharePoint using list items. Returns the number of files processed."""
     try:
         logging.info('Starting SharePoint file processing using list items...')
         
@@ -348,13 +272,11 @@ def process_sharepoint_files(client_id=None, tenant_id=None, config=None, redire
             client_id = CLIENT_ID
         if tenant_id is None:
             tenant_id = TENANT_ID
-        if redirect_url is None:
-            redirect_url = f"msal{CLIENT_ID}://auth"
         
         # Get access token
-        access_token = get_sharepoint_token(client_id, tenant_id, redirect_url)
+        access_token = get_sharepoint_token(client_id, tenant_id)
         if not access_token:
-            return False
+            return 0
         
         # Get SharePoint list items. 
         logging.info('Fetching SharePoint list items...')
@@ -362,15 +284,23 @@ def process_sharepoint_files(client_id=None, tenant_id=None, config=None, redire
         site_name = "jjag.sharepoint.com"
         list_name = "Service Provider Uploads"
         
-        list_items = get_sharepoint_list_items(access_token, site_name, list_name)
+        # Let Graph drop other managers' reports (and, once every flag is set, processed ones) and return only
+        # the columns used below; the checks in the loop stay as a backstop in case the filter is rejected
+        server_filter = _can_filter_processed(access_token, site_name, list_name)
+        list_items = get_sharepoint_list_items(
+            access_token, site_name, list_name,
+            filter_query=UNPROCESSED_FILTER if server_filter else MANAGER_FILTER,
+            select_fields=("Path", "Reportfilename", "Monthlyreportprocessed", "manager")
+        )
         if not list_items:
             logging.warning('No SharePoint list items found')
-            return False
+            return 0
 
         logging.info(f'Found {len(list_items)} items in SharePoint list')
 
         # Filter for unprocessed Excel files
         excel_files = []
+        unset_ids = []
         for item in list_items:
             fields = item.get('fields', {})
             
@@ -381,12 +311,15 @@ def process_sharepoint_files(client_id=None, tenant_id=None, config=None, redire
             
             # Check if monthly report processed 
             monthly_report_processed = (fields.get('Monthlyreportprocessed'))
-            if monthly_report_processed is True:
+            if monthly_report_processed in PROCESSED_VALUES:
                 continue  # Already processed
 
             manager = fields.get('manager', '')
             if manager != 'Julian Brown':
                 continue  # Not the target manager 
+
+            if monthly_report_processed is None:
+                unset_ids.append(item.get('id', ''))
                             
             excel_files.append({
                 'filename': filename,
@@ -397,50 +330,91 @@ def process_sharepoint_files(client_id=None, tenant_id=None, config=None, redire
             })
         
         if not excel_files:
+            # Nothing was unset either, so a full walk has confirmed every flag is set
+            _clear_unset_flags(access_token, [], [])
             logging.warning('No unprocessed Excel files found in SharePoint list')
-            return False
+            return 0
 
         logging.info(f'Found {len(excel_files)} unprocessed Excel files to process')
 
-        # Process each Excel file
-        success_count = 0
-        for file_info in excel_files:
-            try:
-                logging.info(f'Processing: {file_info["filename"]}')
-                
-                # Download file from SharePoint
-                file_content = download_sharepoint_file_from_path(access_token, file_info['path'], file_info['filename'])
-                if not file_content:
-                    logging.error(f'Failed to download: {file_info["filename"]}')
-                    continue
-                
-                # Process the Excel file directly from memory
-                if process_workbook_content_from_memory(file_content, file_info['filename'], access_token):
-                    success_count += 1
-                    logging.info(f'Successfully processed: {file_info["filename"]}')
-                    
-                    # Mark as processed in SharePoint
-                    if mark_file_as_processed(access_token, file_info['item_id']):
-                        logging.info(f'Updated SharePoint list item - marked as processed')
-                    else:
-                        logging.warning(f'Failed to update SharePoint list item status')
-
-                else:
-                    logging.error(f'Failed to process Excel content: {file_info["filename"]}')
-
-            except Exception as e:
-                logging.error(f'Error processing {file_info["filename"]}: {str(e)}')
-
-        logging.info(f'\nSharePoint processing complete: {success_count} out of {len(excel_files)} files processed successfully')
-        return success_count > 0
+        # Resolve every file's download URL up front - one Graph $batch call per 20 files
+        download_urls = get_download_urls(access_token, excel_files)
+
+        # Process the files concurrently - each one is dominated by Graph round trips. Every worker
+        # loads its own workbook from its own bytes, so openpyxl objects are never shared.
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(excel_files))) as executor:
+            results = list(executor.map(lambda file_info: _process_one_file(access_token, file_info, download_urls), excel_files))
+        success_count = sum(results)
+
+        # Flag every converted file in the list at once - one $batch call per 20 items
+        processed_ids = [file_info['item_id'] for file_info, success in zip(excel_files, results) if success]
+        marked_ids = mark_files_as_processed(access_token, processed_ids) if processed_ids else []
+
+        # Give items the run couldn't convert an explicit "No" so the processed filter can see them next time
+        _clear_unset_flags(access_token, unset_ids, marked_ids)
+
+        if len(marked_ids) < len(processed_ids):
+            logging.warning(f'\nSharePoint processing complete: {success_count} out of {len(excel_files)} files processed successfully, '
+                            f'but only {len(marked_ids)} marked as processed - the rest will be converted again next run')
+        else:
+            logging.info(f'\nSharePoint processing complete: {success_count} out of {len(excel_files)} files processed successfully')
+        return success_count
         
     except Exception as e:
         logging.error(f'Error processing SharePoint files: {str(e)}')
+        return 0
+
+
+def _can_filter_processed(access_token, site_name, list_name):
+    """True when the processed flag can go in the server filter without hiding items whose flag is unset"""
+    if not _UNSET_FLAGS_CLEARED:
+        return False
+
+    # New items must get an explicit No from the column default, or they'd be unset (and invisible) again
+    column = get_list_column(access_token, site_name, list_name, "Monthlyreportprocessed")
+    return bool(column and 'boolean' in column and (column.get('defaultValue') or {}).get('value'))
+
+
+def _clear_unset_flags(access_token, unset_ids, marked_ids):
+    """Set the flag to No on listed items that were unset and not marked processed; remembers once none are left"""
+    global _UNSET_FLAGS_CLEARED
+    marked = set(marked_ids)
+    leftover = [item_id for item_id in unset_ids if item_id not in marked]
+    if leftover and len(mark_files_as_processed(access_token, leftover, processed=False)) < len(leftover):
+        return
+    _UNSET_FLAGS_CLEARED = True
+
+
+def _process_one_file(access_token, file_info, download_urls):
+    """Download, convert and upload one listed workbook. Returns True on success; the caller marks it processed."""
+    filename = file_info['filename']
+    try:
+        logging.info(f'Processing: {filename}')
+        
+        # Download file from SharePoint, falling back to the per-file lookup (and search)
+        download_url = download_urls.get(file_info['item_id'])
+        file_content = download_from_url(download_url, filename) if download_url else None
+        if not file_content:
+            file_content = download_sharepoint_file_from_path(access_token, file_info['path'], filename)
+        if not file_content:
+            logging.error(f'Failed to download: {filename}')
+            return False
+        
+        # Process the Excel file directly from memory
+        if not process_workbook_content_from_memory(file_content, filename, access_token):
+            logging.error(f'Failed to process Excel content: {filename}')
+            return False
+
+        logging.info(f'Successfully processed: {filename}')
+        return True
+
+    except Exception as e:
+        logging.error(f'Error processing {filename}: {str(e)}')
         return False
 
 
 def upload_text_to_sharepoint(access_token, file_content, filename):
-    """Upload text content to SharePoint"""
+    """Upload UTF-8 encoded text content (bytes) to SharePoint"""
     try:
         
         headers = {
@@ -448,52 +422,113 @@ def upload_text_to_sharepoint(access_token, file_content, filename):
             'Content-Type': 'text/plain'
         }
         
-        # Get site ID first
-        site_info_url = "https://graph.microsoft.com/v1.0/sites/jjag.sharepoint.com:/sites/InternalTeam:"
-        site_response = requests.get(site_info_url, headers={'Authorization': f'Bearer {access_token}'})
-        
-        if site_response.status_code != 200:
-            logging.error(f'Failed to get site info: {site_response.status_code} - {site_response.text}')
+        # Get site ID first (cached after the first lookup)
+        site_id = get_site_id(access_token)
+        if not site_id:
             return False
-            
-        site_id = site_response.json()['id']
         
-        # Try different path approaches - focusing on the new target location
-        target_paths = [
-            f"/MonthlyReports/{get_current_month_path()}"
-        ]
+        # Upload once to this month's folder; a path-based PUT creates any missing parent folders
+        target_path = f"/MonthlyReports/{get_current_month_path()}"
+
+        # Construct file path for Graph API
+        encoded_path = _encode_path(f"{target_path}/{filename}")
         
-        for target_path in target_paths:
-            try:                
-                # Construct file path for Graph API
-                file_path = f"{target_path}/{filename}"
-                
-                # Clean up path - remove double slashes
-                file_path = file_path.replace('//', '/')
-                
-                # URL encode the path
-                encoded_path = quote(file_path, safe='/')
-                
-                # Try to upload file to SharePoint
-                upload_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:{encoded_path}:/content"
-                
-                upload_response = requests.put(upload_url, headers=headers, data=file_content.encode('utf-8'))
-                
-                if upload_response.status_code in [200, 201]:
-                    logging.info(f"Successfully uploaded to SharePoint: {filename} at path: {target_path}")
-                    return True
-                else:
-                    logging.error(f"Failed with path {target_path}: {upload_response.status_code} - {upload_response.text}")
-
-            except Exception as path_error:
-                logging.error(f"Error with path {target_path}: {str(path_error)}")
-                continue
+        upload_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:{encoded_path}:/content"
+        upload_response = SESSION.put(upload_url, headers=headers, data=file_content)
+        
+        if upload_response.status_code in [200, 201]:
+            logging.info(f"Successfully uploaded to SharePoint: {filename} at path: {target_path}")
+            return True
+
+        logging.error(f"Failed with path {target_path}: {upload_response.status_code} - {upload_response.text}")
+        return False
                 
     except Exception as e:
         logging.error(f"Error uploading file {filename} to SharePoint: {str(e)}")
         return False
 
 
+def _drive_item_path(sharepoint_path, filename):
+    """Build the URL-encoded drive path (for /drive/root:{path}) of a file listed in SharePoint"""
+    # Use the specified SharePoint path for downloads
+    # Default to the new MonthlyReports path, but allow override via sharepoint_path parameter if needed
+    if sharepoint_path and sharepoint_path.strip():
+        # Clean the path - remove "Shared Documents/" if present
+        clean_path = sharepoint_path
+        if clean_path.startswith('Shared Documents/'):
+            clean_path = clean_path[len('Shared Documents/'):]
+        elif clean_path.startswith('/Shared Documents/'):
+            clean_path = clean_path[len('/Shared Documents/'):]
+        target_path = clean_path
+    else:
+        target_path = "sites/InternalTeam/Shared Documents/MonthlyReports/2025/09 - September"
+    
+    # Construct file path for Graph API
+    if target_path:
+        return _encode_path(f"/{target_path}/{filename}")
+    return _encode_path(f"/{filename}")
+
+
+def _encode_path(path):
+    """Normalise a drive path and percent-encode it for use after /drive/root:"""
+    # Collapse repeated slashes (normpath keeps a leading "//", so strip it first)
+    path = posixpath.normpath('/' + path.lstrip('/'))
+    # Encode every reserved character (#, &, +, ...) - not just spaces - so paths resolve first time
+    return quote(path, safe='/')
+
+
+def get_download_urls(access_token, excel_files):
+    """Resolve download URLs for many files with Graph $batch, keyed by list item id"""
+    try:
+        # Get site ID first (cached after the first lookup)
+        site_id = get_site_id(access_token)
+        if not site_id:
+            return {}
+
+        # The driveItem metadata carries a pre-authenticated download URL. The file bytes are
+        # fetched from that URL directly; /content in a batch only returns a redirect.
+        batch_requests = [
+            {
+                "id": str(index),
+                "method": "GET",
+                "url": f"/sites/{site_id}/drive/root:{_drive_item_path(file_info['path'], file_info['filename'])}"
+            }
+            for index, file_info in enumerate(excel_files)
+        ]
+        responses = graph_batch(access_token, batch_requests)
+
+        download_urls = {}
+        for index, file_info in enumerate(excel_files):
+            sub_response = responses.get(str(index), {})
+            if sub_response.get('status') == 200:
+                download_url = sub_response.get('body', {}).get('@microsoft.graph.downloadUrl')
+                if download_url:
+                    download_urls[file_info['item_id']] = download_url
+
+        logging.info(f'Resolved {len(download_urls)} of {len(excel_files)} download URLs via batch')
+        return download_urls
+
+    except Exception as e:
+        logging.error(f'Error resolving download URLs: {str(e)}')
+        return {}
+
+
+def download_from_url(download_url, filename):
+    """Download file content from a pre-authenticated Graph download URL"""
+    try:
+        download_response = SESSION.get(download_url)
+        if download_response.status_code == 200:
+            logging.info(f'Successfully downloaded: {filename}')
+            return download_response.content
+
+        logging.error(f'Error downloading {filename}: {download_response.status_code}')
+        return None
+
+    except Exception as e:
+        logging.error(f'Error downloading file {filename}: {str(e)}')
+        return None
+
+
 def download_sharepoint_file_from_path(access_token, sharepoint_path, filename):
     """Download a file from SharePoint using path and filename"""
     try:
@@ -502,45 +537,17 @@ def download_sharepoint_file_from_path(access_token, sharepoint_path, filename):
             'Accept': 'application/json'
         }
         
-        # Use the specified SharePoint path for downloads
-        # Default to the new MonthlyReports path, but allow override via sharepoint_path parameter if needed
-        if sharepoint_path and sharepoint_path.strip():
-            # Clean the path - remove "Shared Documents/" if present
-            clean_path = sharepoint_path
-            if clean_path.startswith('Shared Documents/'):
-                clean_path = clean_path[len('Shared Documents/'):]
-            elif clean_path.startswith('/Shared Documents/'):
-                clean_path = clean_path[len('/Shared Documents/'):]
-            target_path = clean_path
-        else:
-            target_path = "sites/InternalTeam/Shared Documents/MonthlyReports/2025/09 - September"
-        
-        # Construct file path for Graph API
-        if target_path:
-            file_path = f"/{target_path}/{filename}"
-        else:
-            file_path = f"/{filename}"
-        
-        # Clean up path - remove double slashes
-        file_path = file_path.replace('//', '/')
-        
-        # URL encode the path
-        encoded_path = quote(file_path, safe='/')
+        encoded_path = _drive_item_path(sharepoint_path, filename)
         
-        # Get site ID first
-        site_info_url = "https://graph.microsoft.com/v1.0/sites/jjag.sharepoint.com:/sites/InternalTeam:"
-        site_response = requests.get(site_info_url, headers=headers)
-        
-        if site_response.status_code != 200:
-            logging.error(f'Failed to get site info: {site_response.status_code} - {site_response.text}')
+        # Get site ID first (cached after the first lookup)
+        site_id = get_site_id(access_token)
+        if not site_id:
             return None
-            
-        site_id = site_response.json()['id']
         
         # Try to get file directly
         file_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:{encoded_path}"
         
-        file_response = requests.get(file_url, headers=headers)
+        file_response = SESSION.get(file_url, headers=headers)
         
         if file_response.status_code == 200:
             file_info = file_response.json()
@@ -548,34 +555,41 @@ def download_sharepoint_file_from_path(access_token, sharepoint_path, filename):
             
             if download_url:
                 # Download the actual file content
-                download_response = requests.get(download_url)
+                download_response = SESSION.get(download_url)
                 if download_response.status_code == 200:
                     logging.info(f'Successfully downloaded: {filename}')
                     return download_response.content
-        else:
-            # Fallback: search for the file
+        elif file_response.status_code == 404:
+            # Fallback: the list path is stale, search the drive for the file by name
             search_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/search(q='{filename}')"
-            search_response = requests.get(search_url, headers=headers)
+            # Ask for the download URL in the search results to avoid a detail GET per match
+            search_params = {'$select': 'id,name,@microsoft.graph.downloadUrl'}
+            search_response = SESSION.get(search_url, headers=headers, params=search_params)
             
             if search_response.status_code == 200:
                 search_results = search_response.json().get('value', [])
                 
                 for item in search_results:
                     if item.get('name') == filename:
-                        # Get file details
-                        file_id = item.get('id')
-                        detail_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{file_id}"
-                        detail_response = requests.get(detail_url, headers=headers)
-                        
-                        if detail_response.status_code == 200:
-                            detail_data = detail_response.json()
-                            download_url = detail_data.get('@microsoft.graph.downloadUrl')
-                            
-                            if download_url:
-                                download_response = requests.get(download_url)
-                                if download_response.status_code == 200:
-                                    print(f"Successfully downloaded via search: {filename}")
-                                    return download_response.content
+                        download_url = item.get('@microsoft.graph.downloadUrl')
+
+                        if not download_url:
+                            # Not every search result carries the URL; fetch the item's details
+                            file_id = item.get('id')
+                            detail_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{file_id}"
+                            detail_response = SESSION.get(detail_url, headers=headers)
+
+                            if detail_response.status_code == 200:
+                                download_url = detail_response.json().get('@microsoft.graph.downloadUrl')
+
+                        if download_url:
+                            download_response = SESSION.get(download_url)
+                            if download_response.status_code == 200:
+                                logging.info(f'Successfully downloaded via search: {filename}')
+                                return download_response.content
+        else:
+            # Auth/throttling errors would fail the search the same way, so don't issue it
+            logging.error(f'Error getting file {filename}: {file_response.status_code} - {file_response.text}')
 
         logging.error(f'Failed to download file: {filename}')
         return None
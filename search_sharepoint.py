@@ -1,154 +1,187 @@
-import requests
 from datetime import datetime
 import json
-import msal
 import urllib.parse
+import logging
+from graph_client import SESSION, get_site_id, get_sharepoint_token, graph_batch
 
 def get_sharepoint_access_token(client_id=None, tenant_id=None):
-    """Get SharePoint access token using MSAL (exact same pattern as parse_reports.py)"""
+    """Get SharePoint access token using MSAL (the same cached client app as parse_reports.py, via graph_client)"""
     try:
-        # Use config values or prompt if not provided
-        if not client_id:
-            try:
-                from sharepoint_config import CLIENT_ID
-                client_id = CLIENT_ID
-            except:
-                client_id = input("Enter your Azure AD application client ID: ")
+        # Use config values if not provided - never prompt, this runs unattended
+        if not client_id or not tenant_id:
+            from sharepoint_config import CLIENT_ID, TENANT_ID
+            client_id = client_id or CLIENT_ID
+            tenant_id = tenant_id or TENANT_ID
         
-        if not tenant_id:
-            try:
-                from sharepoint_config import TENANT_ID
-                tenant_id = TENANT_ID
-            except:
-                tenant_id = input("Enter your Azure AD tenant ID: ")
-        
-        # Use the same scopes that work in parse_reports.py
-        scopes = ["https://graph.microsoft.com/.default"]
-        
-        # Tech debt: Temporary workaround should be stored in Key Vault (same as parse_reports.py)
-        client_secret = CLIENT_SECRET
-
-        app = msal.ConfidentialClientApplication(
-            client_id=client_id,
-            client_credential=client_secret,
-            authority=f"https://login.microsoftonline.com/{tenant_id}"
-        )
-       
-        result = app.acquire_token_for_client(scopes=scopes)
-        
-        if "access_token" in result:
-            print("Authentication successful!")
-            return result["access_token"]
-        else:
-            print(f"Error getting token: {result.get('error_description', 'Unknown error')}")
-            return None
+        # Shares graph_client's cached MSAL app, so both modules are served from one token cache
+        return get_sharepoint_token(client_id, tenant_id)
             
     except Exception as e:
-        print(f"Authentication error: {str(e)}")
+        logging.error(f"Authentication error: {str(e)}")
         return None
 
 
-def get_sharepoint_list_items(access_token, site_name, list_name, filter_query=None):
-    """Get items from a SharePoint list using the same approach as parse_reports.py"""
+def _get_all_list_items(list_url, headers, params):
+    """GET list items, following @odata.nextLink; returns (last response, items collected)"""
+    items = []
+    response = SESSION.get(list_url, headers=headers, params=params)
+    while response.status_code == 200:
+        data = response.json()
+        items.extend(data.get('value', []))
+        next_link = data.get('@odata.nextLink')
+        if not next_link:
+            break
+        # The next link already carries the original query options
+        response = SESSION.get(next_link, headers=headers)
+    return response, items
+
+
+def get_sharepoint_list_items(access_token, site_name, list_name, filter_query=None, select_fields=None):
+    """
+    Get items from a SharePoint list using the same approach as parse_reports.py.
+    filter_query is an OData $filter evaluated by Graph (e.g. "fields/Status eq 'Open'");
+    select_fields limits the returned columns to the named fields. All pages are returned.
+    """
+    # GETs only - no request body, so no Content-Type
     headers = {
         'Authorization': f'Bearer {access_token}',
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
+        'Accept': 'application/json'
     }
     
     try:
-        # Method 1: Try direct site access using hostname:/sites/sitename format
-        site_url = f"https://graph.microsoft.com/v1.0/sites/{site_name}:/sites/InternalTeam"        
-        site_response = requests.get(site_url, headers=headers)
-        
-        if site_response.status_code == 200:            
-            site_id = site_response.json()['id']            
-        else:
-            print(f"Error getting site info: {site_response.status_code}")
-            print(site_response.text)
+        # Method 1: Try direct site access using hostname:/sites/sitename format (cached after the first lookup)
+        site_id = get_site_id(access_token, host=site_name)
+        if not site_id:
             return []
         
         # Now try to get the list by list display name
         list_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{urllib.parse.quote(list_name)}/items"
                 
-        # Add expand to get field values and filter if provided
+        # Add expand to get field values (only the selected ones) and filter if provided
         params = {
-            'expand': 'fields'
+            'expand': f"fields(select={','.join(select_fields)})" if select_fields else 'fields',
+            'top': 999
         }
+        if select_fields:
+            # Drop the item-level metadata (contentType, parentReference, timestamps...) as well
+            params['select'] = 'id'
         
         if filter_query:
             params['filter'] = filter_query
+            # Graph refuses filters on non-indexed list columns without this header
+            headers = {**headers, 'Prefer': 'HonorNonIndexedQueriesWarningMayFailRandomly'}
         
-        list_response = requests.get(list_url, headers=headers, params=params)
+        list_response, items = _get_all_list_items(list_url, headers, params)
+
+        if list_response.status_code == 400 and filter_query:
+            # Filter not supported for this list/column: fetch unfiltered and let the caller filter
+            logging.warning(f"List filter rejected ({list_response.text}), retrying without filter")
+            params.pop('filter')
+            list_response, items = _get_all_list_items(list_url, headers, params)
         
         if list_response.status_code == 200:
-            return list_response.json().get('value', [])
+            return items
         else:
-            print(f"List access failed: {list_response.status_code}")
-            print(list_response.text)
+            logging.error(f"List access failed: {list_response.status_code} - {list_response.text}")
             
             # Method 2: Try to get all lists to see what's available
             lists_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists"
-            lists_response = requests.get(lists_url, headers=headers)
+            lists_response = SESSION.get(lists_url, headers=headers)
             
             if lists_response.status_code == 200:
                 lists = lists_response.json().get('value', [])
-                print(f"Available lists in the site:")
+                logging.info("Available lists in the site:")
                 for lst in lists:
-                    print(f"  - {lst.get('displayName')} (ID: {lst.get('id')})")
+                    logging.info(f"  - {lst.get('displayName')} (ID: {lst.get('id')})")
                 
                 # Try to find matching list
                 for lst in lists:
                     if list_name.lower() in lst.get('displayName', '').lower():
-                        print(f"Found matching list: {lst.get('displayName')}")
+                        logging.info(f"Found matching list: {lst.get('displayName')}")
                         list_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{lst.get('id')}/items"
-                        list_response = requests.get(list_url, headers=headers, params=params)
+                        list_response, items = _get_all_list_items(list_url, headers, params)
                         if list_response.status_code == 200:
-                            return list_response.json().get('value', [])
+                            return items
             else:
-                print(f"Could not get lists: {lists_response.status_code}")
+                logging.error(f"Could not get lists: {lists_response.status_code}")
             
             return []
             
     except Exception as e:
-        print(f"Error getting SharePoint list items: {str(e)}")
+        logging.error(f"Error getting SharePoint list items: {str(e)}")
         return []
 
 
+# Column definitions only change when the list is edited, so each is fetched once per process
+_COLUMN_CACHE = {}
+
+
+def get_list_column(access_token, site_name, list_name, column_name):
+    """Return the Graph columnDefinition for column_name on the list (cached), or None if it can't be read"""
+    key = (site_name, list_name, column_name)
+    if key in _COLUMN_CACHE:
+        return _COLUMN_CACHE[key]
+
+    try:
+        site_id = get_site_id(access_token, host=site_name)
+        if not site_id:
+            return None
+
+        columns_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{urllib.parse.quote(list_name)}/columns"
+        response = SESSION.get(columns_url, headers={'Authorization': f'Bearer {access_token}', 'Accept': 'application/json'})
+        if response.status_code != 200:
+            logging.error(f"Could not get list columns: {response.status_code} - {response.text}")
+            return None
+
+        column = next((col for col in response.json().get('value', []) if col.get('name') == column_name), None)
+        _COLUMN_CACHE[key] = column
+        return column
+
+    except Exception as e:
+        logging.error(f"Error getting list column {column_name}: {str(e)}")
+        return None
+
+
 def mark_file_as_processed(access_token, item_id, site_name="jjag.sharepoint.com", list_name="Service Provider Uploads"):
     """Update a SharePoint list item to mark it as processed"""
+    return bool(mark_files_as_processed(access_token, [item_id], site_name, list_name))
+
+
+def mark_files_as_processed(access_token, item_ids, site_name="jjag.sharepoint.com", list_name="Service Provider Uploads", processed=True):
+    """
+    Set Monthlyreportprocessed on several SharePoint list items with Graph $batch; returns the ids that were updated.
+    processed=False writes an explicit "No", e.g. for items whose flag was never set.
+    """
     try:
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        # Get site ID first
-        site_info_url = f"https://graph.microsoft.com/v1.0/sites/{site_name}:/sites/InternalTeam:"
-        site_response = requests.get(site_info_url, headers=headers)
-        
-        if site_response.status_code != 200:
-            print(f"Failed to get site info: {site_response.status_code}")
-            return False
-            
-        site_id = site_response.json()['id']
-        
-        # Update the list item
-        update_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{list_name}/items/{item_id}/fields"
-        
-        update_data = {
-            "Monthlyreportprocessed": True
-        }
-        
-        response = requests.patch(update_url, headers=headers, json=update_data)
-        
-        if response.status_code in [200, 201, 204]:
-            print(f"Successfully marked item {item_id} as processed")
-            return True
-        else:
-            print(f"Failed to mark item as processed: {response.status_code} - {response.text}")
-            return False
-            
+        # Get site ID first (cached after the first lookup)
+        site_id = get_site_id(access_token, host=site_name)
+        if not site_id:
+            return []
+
+        fields_url = f"/sites/{site_id}/lists/{urllib.parse.quote(list_name)}/items/{{}}/fields"
+        batch_requests = [
+            {
+                "id": str(index),
+                "method": "PATCH",
+                "url": fields_url.format(item_id),
+                "headers": {"Content-Type": "application/json"},
+                "body": {"Monthlyreportprocessed": processed}
+            }
+            for index, item_id in enumerate(item_ids)
+        ]
+        responses = graph_batch(access_token, batch_requests)
+
+        marked = []
+        for index, item_id in enumerate(item_ids):
+            sub_response = responses.get(str(index), {})
+            if sub_response.get('status') in [200, 201, 204]:
+                marked.append(item_id)
+            else:
+                logging.error(f"Failed to set processed={processed} on item {item_id}: {sub_response.get('status')} - {sub_response.get('body')}")
+
+        logging.info(f"Set processed={processed} on {len(marked)} of {len(item_ids)} items")
+        return marked
+
     except Exception as e:
-        print(f"Error marking file as processed: {str(e)}")
-        return False
\ No newline at end of file
+        logging.error(f"Error marking files as processed: {str(e)}")
+        return []
@@ -7,7 +7,8 @@ Modify these values to match your SharePoint environment.
 
 from datetime import datetime, timedelta
 import calendar
-from keyvault import get_secret
+import functools
+from keyvault import get_secrets
 
 # SharePoint Site Configuration
 SHAREPOINT_SITE = "jjag.sharepoint.com"
@@ -16,9 +17,19 @@ SHAREPOINT_SITE = "jjag.sharepoint.com"
 
 # File Search Pattern
 SEARCH_PATTERN = "CS Flex Weekly Service Delivery Report"
-CLIENT_ID = get_secret("MONTHLYREPORT-CLIENTID")
-TENANT_ID = get_secret("MONTHLYREPORT-TENANTID")
-CLIENT_SECRET = get_secret("MONTHLYREPORT-CLIENTSECRET")
+# Fetched together so Key Vault lookups run concurrently at startup.
+# The certificate credential for the app registration (PEM private key + SHA-1 thumbprint) is optional;
+# when both are set, MSAL authenticates with the certificate instead of CLIENT_SECRET.
+_SECRETS = get_secrets(
+    ["MONTHLYREPORT-CLIENTID", "MONTHLYREPORT-TENANTID", "MONTHLYREPORT-CLIENTSECRET",
+     "MONTHLYREPORT-CERTTHUMBPRINT", "MONTHLYREPORT-CERTPRIVATEKEY"],
+    defaults={"MONTHLYREPORT-CERTTHUMBPRINT": "", "MONTHLYREPORT-CERTPRIVATEKEY": ""}
+)
+CLIENT_ID = _SECRETS["MONTHLYREPORT-CLIENTID"]
+TENANT_ID = _SECRETS["MONTHLYREPORT-TENANTID"]
+CLIENT_SECRET = _SECRETS["MONTHLYREPORT-CLIENTSECRET"]
+CLIENT_CERT_THUMBPRINT = _SECRETS["MONTHLYREPORT-CERTTHUMBPRINT"]
+CLIENT_CERT_PRIVATE_KEY = _SECRETS["MONTHLYREPORT-CERTPRIVATEKEY"]
 
 
 # Dynamic SharePoint Document Library Path (automatically uses previous month)
@@ -31,13 +42,8 @@ def get_previous_month_path():
     first_day_current_month = today.replace(day=1)
     last_day_previous_month = first_day_current_month - timedelta(days=1)
     
-    # Get previous month details
-    prev_year = last_day_previous_month.year
-    prev_month_num = last_day_previous_month.month
-    prev_month_name = calendar.month_name[prev_month_num]
-    
     # Format: "/sites/InternalTeam/Shared Documents/Restricted/Clients/Julian Brown - Clients/YYYY/MM - MonthName"
-    return f"{prev_year}/{prev_month_num:02d} - {prev_month_name}"
+    return get_specific_month_path(last_day_previous_month.year, last_day_previous_month.month)
 
 
 def get_current_month_path():
@@ -45,15 +51,12 @@ def get_current_month_path():
     # Get current date
     today = datetime.now()
     
-    # Get current month details
-    curr_year = today.year
-    curr_month_num = today.month
-    curr_month_name = calendar.month_name[curr_month_num]
-    
     # Format: "/sites/InternalTeam/Shared Documents/Restricted/Clients/Julian Brown - Clients/YYYY/MM - MonthName"
-    return f"{curr_year}/{curr_month_num:02d} - {curr_month_name}"
+    return get_specific_month_path(today.year, today.month)
 
 
+# Only the date lookup is repeated per call, so a long-running worker still rolls over at month end
+@functools.lru_cache(maxsize=32)
 def get_specific_month_path(year, month):
     """Generate SharePoint path for a specific year and month"""
     month_name = calendar.month_name[month]